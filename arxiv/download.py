@@ -1,55 +1,185 @@
 import argparse
+import asyncio
+import gzip
+import io
+import os
+import zlib
 from pathlib import Path
+import aiofiles
 import arxiv
+import httpx
 from tqdm import tqdm
-import time  # Import time module for throttling
 import datetime
-import re
 
 # Constants
-WAIT_TIME = 3  # seconds to wait between downloads to respect arXiv's rate limits
+WAIT_TIME = 3  # seconds between the starts of download requests to respect arXiv's rate limits
 MAX_TITLE_LENGTH = 200  # Maximum length of the title in the filename to avoid too long filenames
+MAX_CONNECTIONS = 4  # Concurrent downloads, all sharing one pooled HTTP client
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # Bytes handed from the response stream to each file write
+# httpx defaults to 5s for everything; arXiv can be slow to start sending large PDFs and e-prints, and the
+# read timeout applies to each wait for data. Waiting for a pooled connection is bounded by the download slots.
+DOWNLOAD_TIMEOUT = httpx.Timeout(connect=30, read=300, write=30, pool=None)
+RESULTS_PAGE_SIZE = 200  # Results per arXiv API request, the most the API allows
+API_RETRIES = 5  # Attempts per arXiv API page before giving up
+CUTOFF_GRACE = 2  # Papers older than the cutoff to skip past before assuming the rest are older too
+INVALID_FILENAME_CHARS = str.maketrans('', '', '\\/*?:"<>|')  # Translation table deleting characters not allowed in filenames
 
 def filename_friendly_title(title):
     """Sanitize the paper title to make it filename-friendly."""
-    sanitized = re.sub(r'[\\/*?:"<>|]', '', title)  # Remove invalid filename characters
+    sanitized = title.translate(INVALID_FILENAME_CHARS)  # Remove invalid filename characters
     #sanitized = sanitized.replace(' ', '_')  # Replace spaces with underscores
     return sanitized[:MAX_TITLE_LENGTH]  # Truncate title to avoid too long filenames
 
-def download_paper(paper, pdf_output_path:Path, source_output_path:Path=None):
+async def download_file(client:httpx.AsyncClient, url, file_path:Path):
+    """
+    Stream the response body at url into a temporary file next to file_path and rename it into place once complete,
+    so a failed or interrupted transfer never leaves a truncated file that later runs would skip.
+    """
+    tmp_path = file_path.with_name(file_path.name + ".part")
+    try:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            # Chunks are already large, so write them straight through without another userspace buffer
+            async with aiofiles.open(tmp_path, "wb", buffering=0) as f:
+                async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        # Also covers cancellation on Ctrl-C, which interrupts every transfer in flight
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def is_complete_source(buf:io.BytesIO):
+    """
+    Check that a downloaded source archive is not truncated or corrupt. arXiv serves sources gzipped (a tarball or a
+    single gzipped file), so the whole stream is decompressed, which verifies its CRC and length trailer.
+    Anything that is not gzip has nothing to verify and is accepted as is.
+    """
+    if buf.getbuffer()[:2] != b"\x1f\x8b":
+        return True
+    buf.seek(0)
+    try:
+        with gzip.GzipFile(fileobj=buf) as gz:
+            while gz.read(DOWNLOAD_CHUNK_SIZE):
+                pass
+    except (OSError, EOFError, zlib.error):
+        return False
+    return True
+
+async def download_source(client:httpx.AsyncClient, url, file_path:Path):
+    """
+    Download a source archive into memory and check it before writing it. It goes to disk under a temporary name
+    and is renamed into place, so file_path only ever holds a complete archive and a bad download is retried next run.
+    """
+    buf = io.BytesIO()
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        # Keep the bytes exactly as served: decoding a gzip Content-Encoding would store a plain tar as .tar.gz
+        async for chunk in response.aiter_raw(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            buf.write(chunk)
+
+    if not await asyncio.to_thread(is_complete_source, buf):
+        raise ValueError("source archive is truncated or corrupt")
+
+    tmp_path = file_path.with_name(file_path.name + ".part")
+    try:
+        # getbuffer() exposes the downloaded bytes without copying the whole archive again
+        async with aiofiles.open(tmp_path, "wb", buffering=0) as f:
+            await f.write(buf.getbuffer())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+async def acquire_token(bucket:asyncio.Semaphore):
+    """
+    Wait for the shared request token. It is handed back WAIT_TIME seconds after it was taken, whether or not
+    the download has finished, so downloads overlap while new ones still start at most once per WAIT_TIME.
+    """
+    await bucket.acquire()
+    asyncio.get_running_loop().call_later(WAIT_TIME, bucket.release)
+
+async def download_paper(client:httpx.AsyncClient, slots:asyncio.Semaphore, bucket:asyncio.Semaphore, paper, pdf_output_path:Path, source_output_path:Path=None):
     """Download the PDF and optionally the source of a single paper if they don't already exist."""
     filename_stem = f"{paper.get_short_id()} {filename_friendly_title(paper.title)}"
-    
-    # Check and Download PDF
-    pdf_file_path = pdf_output_path / f"{filename_stem}.pdf"
-    if not pdf_file_path.exists():
-        try:
-            paper.download_pdf(dirpath=str(pdf_output_path), filename=pdf_file_path.name)
-            #print(f"Downloaded PDF: {pdf_file_path.name}")
-            time.sleep(WAIT_TIME)  # Throttle requests to respect arXiv's rate limits only when we've actually downloaded
-        except Exception as e:
-            print(f"Error downloading PDF {paper.get_short_id()}: {e}")
-    #else:
-        #print(f"PDF already exists, skipping: {pdf_file_path.name}")
-    
-    # Check and Download source if requested
-    if source_output_path is not None:
-        source_file_path = source_output / f"{filename_stem}.tar.gz"
-        if not source_file_path.exists():
+
+    async with slots:
+        # Check and Download PDF
+        pdf_file_path = pdf_output_path / f"{filename_stem}.pdf"
+        if not pdf_file_path.exists():
             try:
-                paper.download_source(dirpath=str(source_output), filename=source_file_path.name)
-                #print(f"Downloaded source: {source_file_path.name}")
-                
+                await acquire_token(bucket)  # Throttle requests to respect arXiv's rate limits only when we actually download
+                await download_file(client, paper.pdf_url, pdf_file_path)
+                #print(f"Downloaded PDF: {pdf_file_path.name}")
             except Exception as e:
-                print(f"Error downloading source {paper.get_short_id()}: {e}")
+                print(f"Error downloading PDF {paper.get_short_id()}: {e}")
         #else:
-        #    print(f"Source file already exists, skipping: {source_file_path.name}")
-    
-    
+            #print(f"PDF already exists, skipping: {pdf_file_path.name}")
+
+        # Check and Download source if requested
+        if source_output_path is not None:
+            source_file_path = source_output_path / f"{filename_stem}.tar.gz"
+            if not source_file_path.exists():
+                try:
+                    await acquire_token(bucket)  # Sources draw on the same request budget as PDFs
+                    await download_source(client, paper.source_url(), source_file_path)
+                    #print(f"Downloaded source: {source_file_path.name}")
+
+                except Exception as e:
+                    print(f"Error downloading source {paper.get_short_id()}: {e}")
+            #else:
+            #    print(f"Source file already exists, skipping: {source_file_path.name}")
+
+def fetch_papers(client:arxiv.Client, search:arxiv.Search, cutoff_date, loop:asyncio.AbstractEventLoop, queue:asyncio.Queue):
+    """
+    Page through the search results in a background thread, handing each paper inside the date window to the
+    event loop's queue as soon as it arrives, followed by None once the results are exhausted.
+    """
+    older_seen = 0
+    try:
+        for paper in client.results(search):
+            if paper.updated.replace(tzinfo=datetime.timezone.utc) < cutoff_date:
+                # Results are newest-updated first, so the remaining papers are older too; the grace window
+                # only guards against small ordering anomalies around the boundary
+                older_seen += 1
+                if older_seen > CUTOFF_GRACE:
+                    break
+                continue
+            loop.call_soon_threadsafe(queue.put_nowait, paper)
+    except arxiv.UnexpectedEmptyPageError as e:
+        print(f"Encountered an empty page error, end of job")
+    finally:
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+async def download_papers(client:arxiv.Client, search:arxiv.Search, cutoff_date, pdf_output_path:Path, source_output_path:Path=None):
+    """
+    Download papers concurrently over a single pooled HTTP client, at most MAX_CONNECTIONS at a time.
+    The arXiv results are fetched in a background thread, so the next results page is requested while
+    papers from the current one are still downloading.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    producer = loop.run_in_executor(None, fetch_papers, client, search, cutoff_date, loop, queue)
+
+    slots = asyncio.Semaphore(MAX_CONNECTIONS)
+    bucket = asyncio.Semaphore(1)  # Token bucket shared by all downloads, see acquire_token
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True) as http_client:
+        downloads = []
+        with tqdm(total=0, desc="Downloading papers") as progress:
+            while (paper := await queue.get()) is not None:
+                download = asyncio.create_task(download_paper(http_client, slots, bucket, paper, pdf_output_path, source_output_path))
+                download.add_done_callback(lambda _: progress.update())
+                downloads.append(download)
+                progress.total = len(downloads)
+                progress.refresh()
+            await asyncio.gather(*downloads)
+    await producer
 
 def fetch_and_download(subjects, days_back, pdf_output, include_source, source_output):
     """Fetch papers from arXiv and download them."""
-    client = arxiv.Client()
+    client = arxiv.Client(page_size=RESULTS_PAGE_SIZE, delay_seconds=WAIT_TIME, num_retries=API_RETRIES)
 
     cutoff_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_back)
     
@@ -60,16 +190,15 @@ def fetch_and_download(subjects, days_back, pdf_output, include_source, source_o
     pdf_output_path = Path(pdf_output)
     pdf_output_path.mkdir(parents=True, exist_ok=True)
 
+    source_output_path = None
     if include_source:
         source_output_path = Path(source_output)
         source_output_path.mkdir(parents=True, exist_ok=True)
 
-    try:
-        for paper in tqdm(client.results(arxiv.Search(query=search_query, sort_by=arxiv.SortCriterion.SubmittedDate)), desc="Downloading papers"):
-            if paper.updated.replace(tzinfo=datetime.timezone.utc) >= cutoff_date:
-                download_paper(paper, pdf_output_path, source_output_path)
-    except arxiv.UnexpectedEmptyPageError as e:
-        print(f"Encountered an empty page error, end of job")
+    # Sort on the same date the cutoff is applied to, so fetching can stop at the first paper outside the window.
+    # max_results=None must be explicit: arxiv>=3.0 otherwise stops after 100 results, before the cutoff is reached
+    search = arxiv.Search(query=search_query, max_results=None, sort_by=arxiv.SortCriterion.LastUpdatedDate)
+    asyncio.run(download_papers(client, search, cutoff_date, pdf_output_path, source_output_path))
 
     
 
@@ -1,34 +1,46 @@
 import os
+from pathlib import Path
 import fitz  # PyMuPDF
+import pypdfium2 as pdfium
 import argparse
-import xml.etree.ElementTree as ET
+import multiprocessing
+from tqdm import tqdm
+from lxml import etree as ET
 import cairosvg
 
-def rasterize_svg_to_png(svg_path, png_path, default_width=1920, default_height=1080):
+_SVG_NS = "http://www.w3.org/2000/svg"
+_XLINK_NS = "http://www.w3.org/1999/xlink"
+_SVG_TAG = f"{{{_SVG_NS}}}svg"
+_G_TAG = f"{{{_SVG_NS}}}g"
+
+# Compiled once at import so the child scans in strip_text_from_svg run inside libxml2
+_SVG_NAMESPACES = {'svg': _SVG_NS}
+_G_CHILDREN = ET.XPath('./svg:g', namespaces=_SVG_NAMESPACES)
+_USE_DATA_TEXT = ET.XPath('./svg:use[@data-text]', namespaces=_SVG_NAMESPACES)
+
+PNG_DPI = 150  # Resolution of the page images rendered in 'png' mode, by both the pymupdf and pdfium backends
+BACKENDS = ("pymupdf", "pdfium")  # pdfium renders full pages (text included) and only supports 'png' output
+# Image stream filters whose undecoded bytes already form a complete image file, mapped to that file's extension
+RAW_IMAGE_FILTERS = {"/DCTDecode": "jpg", "/JPXDecode": "jpx"}
+DONE_MARKER = ".done"  # Written into a PDF's output directory once all of its pages have been extracted
+
+def rasterize_svg_to_png(root, png_path, default_width=1920, default_height=1080):
     """
-    Converts an SVG file to a PNG file
+    Converts a parsed SVG element tree to a PNG file, without re-reading the SVG from disk.
     Default dimensions are the same ratio as an A4 page (portrait).
 
+    Parameters:
+    - root (lxml.etree._Element): The <svg> root element, e.g. as returned by strip_text_from_svg.
+    - png_path (str): The file path of the output PNG.
     """
 
-    # Parse the SVG file content
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
-
     # Ensure the SVG has defined width and height
     if 'width' not in root.attrib or 'height' not in root.attrib:
         root.set('width', f"{default_width}px")
         root.set('height', f"{default_height}px")
 
-        # Convert the modified SVG tree back to a string
-        svg_content = ET.tostring(root, encoding='utf-8', method='xml')
-    else:
-        # If width and height are present, read the file content as is
-        with open(svg_path, 'rb') as svg_file:
-            svg_content = svg_file.read()
-
     # Convert the SVG (with definite dimensions) to PNG
-    cairosvg.svg2png(bytestring=svg_content, write_to=png_path)
+    cairosvg.svg2png(bytestring=ET.tostring(root, encoding='utf-8', method='xml'), write_to=png_path)
 
 def strip_text_from_svg(svg_content):
     """
@@ -40,84 +52,207 @@ def strip_text_from_svg(svg_content):
     - svg_content (str): A string containing the SVG content to have its text stripped.
 
     Returns:
-    - str: The stripped SVG content as a string.
+    - lxml.etree._Element: The <svg> root element of the stripped SVG.
     """
 
-    # Register namespaces to preserve structure and prefixes
-    ET.register_namespace('', "http://www.w3.org/2000/svg")
-    ET.register_namespace('xlink', "http://www.w3.org/1999/xlink")
-
-    # Parse the SVG content
-    root = ET.fromstring(svg_content)
+    # Parse the SVG content as bytes, since lxml rejects str input that carries an XML encoding declaration.
+    # lxml keeps the document's own namespace prefixes, so no namespace registration is needed.
+    root = ET.fromstring(svg_content.encode('utf-8'))
 
     # Check if there's only one <g> tag directly under the <svg> root
-    g_tags = [child for child in root if child.tag == '{http://www.w3.org/2000/svg}g']
+    g_tags = _G_CHILDREN(root)
     if len(g_tags) == 1:
         # Use the single <g> tag as the new root
         root = g_tags[0]
 
-    # Iterate over a copy of the root's children
-    for child in list(root):
-        # Check if the child is a <use> element with a 'data-text' attribute
-        if child.tag == '{http://www.w3.org/2000/svg}use' and 'data-text' in child.attrib:
-            # Remove the child from the root
-            root.remove(child)
-
-    # Return the modified SVG content as a string
-    # If the root was changed to a <g> tag, wrap the output in an <svg> tag to ensure validity
-    if root.tag == '{http://www.w3.org/2000/svg}g':
-        return '<svg xmlns="http://www.w3.org/2000/svg">' + ET.tostring(root, encoding='unicode', method='xml') + '</svg>'
+    # Remove the <use> children that carry a 'data-text' attribute
+    for child in _USE_DATA_TEXT(root):
+        root.remove(child)
+
+    # If the root was changed to a <g> tag, wrap it in an <svg> tag to ensure validity
+    if root.tag == _G_TAG:
+        svg_root = ET.Element(_SVG_TAG, nsmap={None: _SVG_NS, 'xlink': _XLINK_NS})
+        svg_root.append(root)
+        return svg_root
     else:
-        return ET.tostring(root, encoding='unicode', method='xml')
+        return root
 
-def extract_pdf_pymupdf(pdf_path, output_dir, output_type="text"):
+def extract_page(doc, page, output_dir, output_type="text"):
     """
-    Extracts content from a PDF file using PyMuPDF (fitz) and saves it to the specified directory.
-    Supports extracting plain text and images or converting pages to SVG and then rasterizing to PNG.
+    Extracts content from a single page of an open PyMuPDF document and saves it to the specified directory.
 
     Parameters:
-    - pdf_path (str): The file path of the input PDF.
+    - doc (fitz.Document): The open document the page belongs to (needed to extract embedded images).
+    - page (fitz.Page): The page to extract.
     - output_dir (str): The directory path where the extracted content should be saved.
-    - output_type (str, optional): The type of output to extract ('text' or 'svg'). Defaults to 'text'.
+    - output_type (str, optional): The type of output to extract ('text', 'svg' or 'png'). Defaults to 'text'.
     """
 
-    doc = fitz.open(pdf_path)
-
-    for page in doc:
-        if output_type == "text":
-            # Extract and save text and images as before
-            text = page.get_text()
-            text_path = os.path.join(output_dir, f"page{page.number}_text.txt")
-            with open(text_path, "w") as text_file:
-                text_file.write(text)
+    if output_type == "text":
+        # Extract and save text and images as before. Each file is written as bytes in one call,
+        # so there is no newline translation on Windows
+        text = page.get_text()
+        text_path = os.path.join(output_dir, f"page{page.number}_text.txt")
+        Path(text_path).write_bytes(text.encode("utf-8"))
 
-            images = page.get_images(full=True)
-            for img_index, img in enumerate(images):
-                xref = img[0]
+        # get_images only lists the page's /Resources XObjects and does not interpret the content stream, so it
+        # adds no second page walk. Extracting both from get_text('rawdict') would be slower (one dict per
+        # character) and gives no image xrefs, which the file names below rely on.
+        images = page.get_images(full=True)
+        for img_index, img in enumerate(images):
+            xref = img[0]
+            # JPEG and JPEG 2000 streams are written as stored; only other encodings go through extract_image
+            filter_type, filter_name = doc.xref_get_key(xref, "Filter")
+            ext = RAW_IMAGE_FILTERS.get(filter_name) if filter_type == "name" else None
+            if ext is not None:
+                image_bytes = doc.xref_stream_raw(xref)
+            else:
                 image = doc.extract_image(xref)
                 image_bytes = image["image"]
-                img_path = os.path.join(output_dir, f"page{page.number}-image{xref}.png")
-                with open(img_path, "wb") as img_file:
-                    img_file.write(image_bytes)
-        elif output_type == "svg":
-            # Generate and save SVG for each page
-            svg = page.get_svg_image(matrix=fitz.Identity)
-            filtered_svg = strip_text_from_svg(svg)
-            svg_path = os.path.join(output_dir, f"page{page.number}.svg")
-            with open(svg_path, "w") as svg_file:
-                svg_file.write(filtered_svg)
-            
-            # Rasterize the filtered SVG into PNG
-            png_path = os.path.join(output_dir, f"page{page.number}.png")
-            rasterize_svg_to_png(svg_path, png_path)
-
-def get_output_dir(source_dir, output_type="text"):
+                ext = image["ext"]
+            img_path = os.path.join(output_dir, f"page{page.number}-image{xref}.{ext}")
+            Path(img_path).write_bytes(image_bytes)
+    elif output_type == "svg":
+        # Generate and save SVG for each page
+        svg = page.get_svg_image(matrix=fitz.Identity)
+        svg_root = strip_text_from_svg(svg)
+        svg_path = os.path.join(output_dir, f"page{page.number}.svg")
+        Path(svg_path).write_bytes(ET.tostring(svg_root, encoding='utf-8', method='xml'))
+
+        # Rasterize the filtered SVG tree straight into PNG, reusing the in-memory tree
+        png_path = os.path.join(output_dir, f"page{page.number}.png")
+        rasterize_svg_to_png(svg_root, png_path)
+    elif output_type == "png":
+        # Render an image-only PNG straight from the page: redact all text (leaving images and
+        # vector graphics alone) and rasterize, with no SVG or CairoSVG round-trip
+        page.add_redact_annot(page.rect, fill=False)
+        page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE, graphics=fitz.PDF_REDACT_LINE_ART_NONE)
+        pix = page.get_pixmap(dpi=PNG_DPI, alpha=False)
+        png_path = os.path.join(output_dir, f"page{page.number}.png")
+        pix.save(png_path)
+
+def extract_page_pdfium(pdf, page_number, output_dir):
+    """
+    Renders a single page of an open pypdfium2 document to PNG in the specified directory.
+    Unlike PyMuPDF's 'png' mode the text is not removed: pdfium draws the whole page in one native call.
+
+    Parameters:
+    - pdf (pypdfium2.PdfDocument): The open document.
+    - page_number (int): The zero-based number of the page to render.
+    - output_dir (str): The directory path where the PNG should be saved.
+    """
+
+    page = pdf[page_number]
+    # rev_byteorder makes pdfium emit RGB rather than BGR, so PIL takes the buffer without converting it
+    bitmap = page.render(scale=PNG_DPI / 72, rev_byteorder=True)
+    png_path = os.path.join(output_dir, f"page{page_number}.png")
+    bitmap.to_pil().save(png_path)
+    page.close()
+
+def is_supported_backend(output_type, backend):
+    """
+    Checks that the backend exists and can produce the requested output type, printing why not otherwise.
+
+    Returns:
+    - bool: True if the combination is supported.
+    """
+
+    if backend not in BACKENDS:
+        print(f"Unsupported backend: {backend}")
+        return False
+    if backend == "pdfium" and output_type != "png":
+        print(f"Backend 'pdfium' only supports 'png' output, not: {output_type}")
+        return False
+    return True
+
+def extract_pdf(pdf_path, output_dir, output_type="text", backend="pymupdf"):
+    """
+    Extracts content from a PDF file and saves it to the specified directory.
+    With the PyMuPDF (fitz) backend, supports extracting plain text and images, converting pages to SVG and then
+    rasterizing to PNG, or rendering image-only PNGs directly. The pdfium backend renders full-page PNGs.
+    Pages are processed one after another in the calling process; process_pdfs spreads pages over a pool instead.
+
+    Parameters:
+    - pdf_path (str): The file path of the input PDF.
+    - output_dir (str): The directory path where the extracted content should be saved.
+    - output_type (str, optional): The type of output to extract ('text', 'svg' or 'png'). Defaults to 'text'.
+    - backend (str, optional): The rendering backend ('pymupdf' or 'pdfium'). Defaults to 'pymupdf'.
+    """
+
+    if not is_supported_backend(output_type, backend):
+        return
+
+    if backend == "pdfium":
+        pdf = pdfium.PdfDocument(pdf_path)
+        for page_number in range(len(pdf)):
+            extract_page_pdfium(pdf, page_number, output_dir)
+        pdf.close()
+    else:
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                extract_page(doc, page, output_dir, output_type)
+    mark_done(output_dir)
+
+def mark_done(output_dir):
+    """
+    Atomically records that a PDF has been fully extracted into output_dir, so later runs can skip it.
+    The marker is created under a temporary name and renamed into place, so a crash never leaves a marker behind
+    for a partial extraction.
+    """
+
+    tmp_path = os.path.join(output_dir, DONE_MARKER + ".tmp")
+    Path(tmp_path).write_bytes(b"")
+    os.replace(tmp_path, os.path.join(output_dir, DONE_MARKER))
+
+# Per-process document handle, so a worker rendering consecutive pages of one PDF opens it only once
+_doc = None
+_doc_key = None
+
+def _init_worker():
+    """Pool initializer: starts each worker process without an open document."""
+
+    global _doc, _doc_key
+    _doc = None
+    _doc_key = None
+
+def _get_doc(pdf_path, backend="pymupdf"):
+    """Returns this process's open handle for pdf_path, reopening only when the worker moves on to another PDF."""
+
+    global _doc, _doc_key
+    if _doc_key != (pdf_path, backend):
+        if _doc is not None:
+            _doc.close()
+        # Both libraries are given the path and read the file on demand, so workers on the same PDF already share
+        # the OS page cache. fitz.open(stream=mmap_obj) is not an option: PyMuPDF only accepts bytes, bytearray,
+        # memoryview or BytesIO there and raises TypeError for an mmap. stream=memoryview(mmap_obj) would open
+        # without copying, but it reads through the same page cache, so it gains nothing over the path.
+        _doc = pdfium.PdfDocument(pdf_path) if backend == "pdfium" else fitz.open(pdf_path)
+        _doc_key = (pdf_path, backend)
+    return _doc
+
+def render_page(args):
+    """
+    Pool entry point: unpacks a (pdf_path, page_number, output_dir, output_type, backend) tuple and extracts that page.
+    Lives at module level so it can be pickled and sent to worker processes.
+    """
+
+    pdf_path, page_number, output_dir, output_type, backend = args
+    doc = _get_doc(pdf_path, backend)
+    if backend == "pdfium":
+        extract_page_pdfium(doc, page_number, output_dir)
+    else:
+        extract_page(doc, doc[page_number], output_dir, output_type)
+    return pdf_path
+
+def get_output_dir(source_dir, output_type="text", backend="pymupdf"):
     """
     Determines the output directory based on the source directory and the specified output type.
+    pdfium's full-page PNGs get their own directory, so they never mix with (or are skipped as) PyMuPDF's text-free ones.
 
     Parameters:
     - source_dir (str): The base directory where the source files are located.
-    - output_type (str, optional): The type of output ('text' or 'svg') to determine the subdirectory. Defaults to 'text'.
+    - output_type (str, optional): The type of output ('text', 'svg' or 'png') to determine the subdirectory. Defaults to 'text'.
+    - backend (str, optional): The rendering backend ('pymupdf' or 'pdfium'). Defaults to 'pymupdf'.
 
     Returns:
     - str or None: The path to the output directory, or None if the output type is unsupported.
@@ -127,42 +262,83 @@ def get_output_dir(source_dir, output_type="text"):
         return os.path.join(source_dir, "extracted-text")
     elif output_type == "svg":
         return os.path.join(source_dir, "extracted-svg")
+    elif output_type == "png" and backend == "pdfium":
+        return os.path.join(source_dir, "extracted-png-pdfium")
+    elif output_type == "png":
+        return os.path.join(source_dir, "extracted-png")
     else:
         print(f"Unsupported type: {output_type}")
         return None
 
-def process_pdfs(source_dir, output_type="text", limit=None):
+def process_pdfs(source_dir, output_type="text", limit=None, parallelism=None, backend="pymupdf"):
     """
     Processes PDF files from a source directory, extracting content as specified by the output type.
+    Pages of all PDFs are spread over a pool of worker processes, so a single large PDF still uses every core.
+    PDFs whose output directory already holds a done marker from an earlier run are skipped.
     Can optionally limit the number of processed files.
 
     Parameters:
     - source_dir (str): The directory containing the PDF files to be processed.
-    - output_type (str, optional): The type of content to extract from the PDFs ('text' or 'svg'). Defaults to 'text'.
-    - limit (int, optional): The maximum number of PDF files to process. If None, all PDFs in the source directory are processed.
+    - output_type (str, optional): The type of content to extract from the PDFs ('text', 'svg' or 'png'). Defaults to 'text'.
+    - limit (int, optional): The maximum number of PDF files to process, not counting ones already extracted. If None, all PDFs in the source directory are processed.
+    - parallelism (int, optional): The number of worker processes to use. If None, one per CPU core.
+    - backend (str, optional): The rendering backend ('pymupdf' or 'pdfium'). Defaults to 'pymupdf'.
     """
 
-    extracted_dir = get_output_dir(source_dir, output_type)
+    if not is_supported_backend(output_type, backend):
+        return
+
+    extracted_dir = get_output_dir(source_dir, output_type, backend)
     if extracted_dir is None:
         return
 
     os.makedirs(extracted_dir, exist_ok=True)
-    pdfs = [f for f in os.listdir(source_dir) if f.endswith(".pdf")]
+    # DirEntry carries the file type from the directory listing, so no extra stat per file
+    with os.scandir(source_dir) as entries:
+        pdfs = [entry for entry in entries if entry.name.endswith(".pdf") and entry.is_file()]
+
+    # Drop PDFs already extracted by an earlier run before applying the limit, so a capped rerun moves on to new ones
+    todo = []
+    for entry in pdfs:
+        output_dir = os.path.join(extracted_dir, entry.name[:-len(".pdf")])
+        if not os.path.exists(os.path.join(output_dir, DONE_MARKER)):
+            todo.append((entry, output_dir))
     if limit:
-        pdfs = pdfs[:limit]
+        todo = todo[:limit]
 
-    for pdf_name in pdfs:
-        arxiv_id = os.path.splitext(pdf_name)[0]
-        output_dir = os.path.join(extracted_dir, arxiv_id)
+    jobs = []
+    pending = {}  # pdf_path -> [pages still to extract, output_dir]
+    for entry, output_dir in todo:
         os.makedirs(output_dir, exist_ok=True)
-        pdf_path = os.path.join(source_dir, pdf_name)
-        extract_pdf_pymupdf(pdf_path, output_dir, output_type)
+        pdf_path = entry.path
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        if page_count == 0:
+            mark_done(output_dir)
+            continue
+        pending[pdf_path] = [page_count, output_dir]
+        jobs.extend((pdf_path, i, output_dir, output_type, backend) for i in range(page_count))
+
+    if not jobs:
+        return
+
+    processes = parallelism or os.cpu_count()
+    # Hand out pages in runs so each worker mostly stays on one PDF and reuses its open handle
+    chunksize = max(1, len(jobs) // (processes * 4))
+    with multiprocessing.Pool(processes=processes, initializer=_init_worker) as pool:
+        for pdf_path in tqdm(pool.imap_unordered(render_page, jobs, chunksize=chunksize), total=len(jobs), desc="Extracting pages"):
+            remaining = pending[pdf_path]
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                mark_done(remaining[1])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-e", "--output-type", default="text", help="Specify output type: 'text' or 'svg'.")
+    parser.add_argument("-e", "--output-type", default="text", help="Specify output type: 'text', 'svg' or 'png'.")
     parser.add_argument("-s", "--source", default="cs_CL-cs_AI", help="Specify the source directory containing PDF files.")
     parser.add_argument("-l", "--limit", type=int, help="Limit the number of processed PDF files.")
+    parser.add_argument("-p", "--parallelism", type=int, help="Number of worker processes. Defaults to the number of CPU cores.")
+    parser.add_argument("-b", "--backend", default="pymupdf", choices=BACKENDS, help="Rendering backend. 'pdfium' renders full pages and requires '-e png'.")
 
     args = parser.parse_args()
-    process_pdfs(args.source, args.output_type, args.limit)
+    process_pdfs(args.source, args.output_type, args.limit, args.parallelism, args.backend)
@@ -47,6 +47,7 @@ def multi_turn_search_sample(
         conversation_name = conversation.name
         print(f"Conversation ID: {conversation.name.split('/')[-1]}")
 
+    responses = []
     for search_query in search_queries:
         request = discoveryengine.ConverseConversationRequest(
             name=conversation_name,
@@ -63,7 +64,11 @@ def multi_turn_search_sample(
             ),
         )
         response = client.converse_conversation(request)
-        print(response)
+        # Print just the summary; the full response (search results, citations) is returned to the caller
+        print(response.reply.summary.summary_text)
+        responses.append(response)
+
+    return responses
 
 if __name__ == "__main__":
     search_queries, conversation_id = parse_arguments()  # Updated to unpack conversation_id